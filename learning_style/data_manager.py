@@ -1,16 +1,79 @@
 import asyncio
 import difflib
+import heapq
 import json
 import os
 import re
+import sys
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from typing import Any
+from urllib.parse import quote, unquote
 
 from astrbot.api import logger
 
+try:
+    import orjson
+except ImportError:  # 可选依赖，未安装时回退到标准库 json
+    orjson = None
+
 
 # 情境表征缓冲比例（硬编码）
 CONTEXTUAL_BUFFER_RATIO = 0.2  # 20% 为缓冲位
 
+# 三层表征，每层按会话分片存储在同名子目录下
+LAYERS = ("universal", "contextual", "specific")
+
+
+def _dumps(obj: Any, default: Callable[[Any], Any] | None = None) -> bytes:
+    """
+    序列化为紧凑的 UTF-8 字节。在事件循环内调用，得到的是调用时刻的一致快照。
+    default 用于转换 JSON 原生不支持的对象（如 deque），语义与 json.dumps 相同。
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=default)
+    return json.dumps(obj, ensure_ascii=False, default=default).encode("utf-8")
+
+
+def _dumps_line(obj: Any) -> bytes:
+    """序列化为一行 JSONL。orjson 直接在输出缓冲区末尾写入换行，省去一次拼接拷贝。"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _render_message(message: dict[str, Any]) -> str:
+    return f"{message['sender']}: {message['content']}"
+
+
+def _to_valid_utf8(text: Any) -> Any:
+    # 孤立代理等无法编码为 UTF-8 的字符替换为 "?"，否则日志与快照都会序列化失败
+    if type(text) is str:
+        return text.encode("utf-8", "replace").decode("utf-8")
+    return text
+
+
+def _intern_sender(message: dict[str, Any]) -> dict[str, Any]:
+    # 同一发送者的名字在每条消息里各有一份，驻留后所有消息共享同一个字符串对象
+    sender = message.get("sender")
+    if type(sender) is str:
+        message["sender"] = sys.intern(sender)
+    return message
+
+
+def _buffer_count(total: int) -> int:
+    return max(1, int(total * CONTEXTUAL_BUFFER_RATIO))
+
+
+def _loads(data: bytes) -> Any:
+    # orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，调用方统一捕获后者即可
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 class DataManager:
     """
@@ -22,37 +85,52 @@ class DataManager:
 
     def __init__(self, data_dir: str, config: dict):
         self.data_dir = data_dir
-        self.universal_file = os.path.join(data_dir, "universal.json")
-        self.contextual_file = os.path.join(data_dir, "contextual.json")
-        self.specific_file = os.path.join(data_dir, "specific.json")
+        self.layer_dirs = {layer: os.path.join(data_dir, layer) for layer in LAYERS}
         self.chat_history_file = os.path.join(data_dir, "chat_history.json")
+        self.chat_history_log_file = os.path.join(data_dir, "chat_history.log")
 
         self.universal: dict[str, list[dict[str, Any]]] = {}
         self.contextual: dict[str, list[dict[str, Any]]] = {}
         self.specific: dict[str, list[dict[str, Any]]] = {}
-        self.chat_history: dict[str, list[dict[str, Any]]] = {}
+        self.chat_history: dict[str, deque[dict[str, Any]]] = {}
+        # 与 chat_history 一一对应的 "发送者: 内容" 文本，构建分析 prompt 时直接复用
+        self._rendered_history: dict[str, deque[str]] = {}
+        # session_id -> (建索引时的特定表征列表, content -> 表征)
+        self._specific_index: dict[
+            str, tuple[list[dict[str, Any]], dict[str, dict[str, Any]]]
+        ] = {}
 
         self.config = config
 
+        # 各层中有未保存修改的会话，保存时只重写这些会话的分片
+        self._dirty_sessions: dict[str, set[str]] = {layer: set() for layer in LAYERS}
+        # 会话表征每次变更都会递增版本号，供下游按版本缓存派生结果
+        self.styles_version: dict[str, int] = {}
+        self._dirty_chat_history = False
+        self._save_timer = None
+        self._save_delay = 5.0
+        self._save_deadline = 0.0
+
         self._ensure_data_dir()
         self._handle_old_format()
         self.load_universal()
         self.load_contextual()
         self.load_specific()
         self.load_chat_history()
+        # 聊天记录以追加日志增量落盘，chat_history.json 仅作为周期快照
+        self._history_log = open(self.chat_history_log_file, "ab")
+        # 尚未写入日志的新消息，由调度器周期性调用 flush_history 批量落盘
+        self._pending_history: list[tuple[str, dict[str, Any]]] = []
         self.lock = asyncio.Lock()
-
-        self._dirty_universal = False
-        self._dirty_contextual = False
-        self._dirty_specific = False
-        self._dirty_chat_history = False
-        self._save_timer = None
-        self._save_delay = 5.0
+        # 所有文件写入都提交到这个单线程执行器，按提交顺序串行执行
+        self._io_executor = ThreadPoolExecutor(max_workers=1)
 
     def _ensure_data_dir(self):
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
             logger.info(f"创建数据目录: {self.data_dir}")
+        for layer_dir in self.layer_dirs.values():
+            os.makedirs(layer_dir, exist_ok=True)
 
     def _handle_old_format(self):
         old_file = os.path.join(self.data_dir, "styles.json")
@@ -65,15 +143,7 @@ class DataManager:
     # ==================== 通用表征 ====================
 
     def load_universal(self):
-        if os.path.exists(self.universal_file):
-            try:
-                with open(self.universal_file, encoding="utf-8") as f:
-                    self.universal = json.load(f)
-            except (OSError, json.JSONDecodeError) as e:
-                logger.error(f"加载通用表征文件失败: {e}")
-                self.universal = {}
-        else:
-            self.universal = {}
+        self.universal = self._load_layer("universal", "通用表征")
 
     def get_universal_for_session(self, session_id: str) -> list[dict[str, Any]]:
         return self.universal.get(session_id, [])
@@ -84,7 +154,7 @@ class DataManager:
         - 延续的表征 proficiency +5，confirmed_rounds +1
         - 新增的表征 proficiency=10，confirmed_rounds=1
         """
-        current_time = asyncio.get_running_loop().time()
+        current_time = time.monotonic()
         old_map = {}
         for trait in self.universal.get(session_id, []):
             old_map[trait["content"]] = trait
@@ -108,93 +178,90 @@ class DataManager:
                 })
 
         self.universal[session_id] = new_traits
-        self._dirty_universal = True
-        asyncio.create_task(self._schedule_save())
+        self._mark_dirty("universal", session_id)
+        self._schedule_save()
 
     async def save_universal(self):
-        async with self.lock:
-            try:
-                with open(self.universal_file, "w", encoding="utf-8") as f:
-                    json.dump(self.universal, f, ensure_ascii=False, indent=4)
-                self._dirty_universal = False
-            except OSError as e:
-                logger.error(f"保存通用表征文件失败: {e}")
+        await self._save_layer("universal", "通用表征")
 
     # ==================== 情境表征 ====================
 
     def load_contextual(self):
-        if os.path.exists(self.contextual_file):
-            try:
-                with open(self.contextual_file, encoding="utf-8") as f:
-                    self.contextual = json.load(f)
-            except (OSError, json.JSONDecodeError) as e:
-                logger.error(f"加载情境表征文件失败: {e}")
-                self.contextual = {}
-        else:
-            self.contextual = {}
+        self.contextual = self._load_layer("contextual", "情境表征")
 
     def get_contextual_for_session(self, session_id: str) -> list[dict[str, Any]]:
         return self.contextual.get(session_id, [])
 
     def get_contextual_buffer(self, session_id: str) -> list[dict[str, Any]]:
         """仅返回缓冲位中的情境表征（供维护合并用）。"""
-        return [
-            t
-            for t in self.contextual.get(session_id, [])
-            if t.get("_in_buffer")
-        ]
+        traits = self.contextual.get(session_id)
+        if not traits:
+            return []
+        # 缓冲位始终是列表尾部的连续区间，直接切片即可
+        return traits[-_buffer_count(len(traits)):]
 
-    def add_contextual(self, session_id: str, scene: str, behavior: str):
+    def add_contextual_bulk(self, session_id: str, pairs: list[tuple[str, str]]):
         """
-        添加情境表征。
+        批量添加情境表征，容量检查、缓冲位标记与保存调度只做一次。
         - FIFO 添加，标记为缓冲位
         - 超容量 50 时淘汰最早的
         - 自动调整缓冲位标记（最新 20% 为缓冲）
         """
-        current_time = asyncio.get_running_loop().time()
-        if session_id not in self.contextual:
-            self.contextual[session_id] = []
-
-        self.contextual[session_id].append({
-            "scene": scene,
-            "behavior": behavior,
-            "created_at": current_time,
-            "_in_buffer": True,
-        })
+        if not pairs:
+            return
 
-        # FIFO 容量检查
+        current_time = time.monotonic()
+        traits = self.contextual.setdefault(session_id, [])
+        for scene, behavior in pairs:
+            traits.append({
+                "scene": scene,
+                "behavior": behavior,
+                "created_at": current_time,
+                "_in_buffer": True,
+            })
+
+        # FIFO 容量检查：一次切片删除所有超出的最早条目，而不是逐个 pop(0)
         max_capacity = self.config.get("max_contextual_per_session", 50)
-        while len(self.contextual[session_id]) > max_capacity:
-            removed = self.contextual[session_id].pop(0)
-            logger.debug(
-                f"FIFO 淘汰情境表征: {removed.get('scene', '?')}→{removed.get('behavior', '?')}"
-            )
+        excess = len(traits) - max_capacity
+        if excess > 0:
+            for removed in traits[:excess]:
+                logger.debug(
+                    f"FIFO 淘汰情境表征: {removed.get('scene', '?')}→{removed.get('behavior', '?')}"
+                )
+            del traits[:excess]
 
         # 重新标记缓冲位（最新 20%）
         self._refresh_buffer_markers(session_id)
-        self._dirty_contextual = True
-        asyncio.create_task(self._schedule_save())
+        self._mark_dirty("contextual", session_id)
+        self._schedule_save()
 
     def _refresh_buffer_markers(self, session_id: str):
         """重新计算并标记情境表征的缓冲位。"""
         traits = self.contextual.get(session_id, [])
         if not traits:
             return
-        buffer_count = max(1, int(len(traits) * CONTEXTUAL_BUFFER_RATIO))
-        for i, t in enumerate(traits):
-            t["_in_buffer"] = (i >= len(traits) - buffer_count)
-
-    def mark_contextual_merged(self, session_id: str, index: int):
-        """从情境列表中移除已合并的条目。"""
-        if session_id in self.contextual and 0 <= index < len(self.contextual[session_id]):
-            self.contextual[session_id].pop(index)
-            self._refresh_buffer_markers(session_id)
-            self._dirty_contextual = True
-            asyncio.create_task(self._schedule_save())
-
-    def merge_contextual_buffer(self, session_id: str, threshold: float = 0.85):
+        boundary = len(traits) - _buffer_count(len(traits))
+        for t in traits[boundary:]:
+            t["_in_buffer"] = True
+        # 缓冲位始终是列表尾部的连续区间，只需从边界向前清除，遇到非缓冲项即停
+        for i in range(boundary - 1, -1, -1):
+            t = traits[i]
+            if not t.get("_in_buffer"):
+                break
+            t["_in_buffer"] = False
+
+    async def perform_maintenance(self, threshold: float = 0.85):
+        """一次遍历所有会话合并情境缓冲区，全部完成后统一保存一次。"""
+        for session_id in list(self.contextual.keys()):
+            try:
+                self._merge_contextual_buffer(session_id, threshold)
+            except Exception as e:
+                logger.error(f"维护会话 {session_id} 时出错: {e}")
+        await self.force_save()
+
+    def _merge_contextual_buffer(self, session_id: str, threshold: float):
         """
-        将缓冲位的情境表征尝试合并到通用/特定。
+        将缓冲位的情境表征尝试合并到通用/特定（只修改内存并标记脏数据，不调度保存）。
         遍历缓冲条目，按 scene→behavior 文本相似度：
         1. 跟通用比对 → 匹配则合并proficiency，从情境移除
         2. 跟特定比对 → 匹配则合并trigger_count，从情境移除
@@ -203,6 +270,10 @@ class DataManager:
         if session_id not in self.contextual:
             return
 
+        # 候选表征的匹配器在首次用到时构建一次，之后每个缓冲条目只替换比对文本
+        universal_matchers = None
+        specific_matchers = None
+
         remaining = []
         for item in self.contextual[session_id]:
             if not item.get("_in_buffer"):
@@ -213,105 +284,143 @@ class DataManager:
             merged = False
 
             # 尝试合并到通用
-            if session_id in self.universal:
-                for u in self.universal[session_id]:
-                    score = difflib.SequenceMatcher(None, text, u["content"]).ratio()
-                    if score > threshold:
-                        u["proficiency"] = min(100, u.get("proficiency", 0) + 5)
-                        merged = True
-                        logger.debug(f"情境 '{text}' 合并到通用 '{u['content']}'")
-                        break
+            if universal_matchers is None:
+                universal_matchers = self._build_matchers(
+                    self.universal.get(session_id, [])
+                )
+            for u, matcher in universal_matchers:
+                matcher.set_seq1(text)
+                if matcher.ratio() > threshold:
+                    u["proficiency"] = min(100, u.get("proficiency", 0) + 5)
+                    self._mark_dirty("universal", session_id)
+                    merged = True
+                    logger.debug(f"情境 '{text}' 合并到通用 '{u['content']}'")
+                    break
 
             if merged:
                 continue
 
             # 尝试合并到特定
-            if session_id in self.specific:
-                for s in self.specific[session_id]:
-                    score = difflib.SequenceMatcher(
-                        None, text, s["content"]
-                    ).ratio()
-                    if score > threshold:
-                        s["trigger_count"] = s.get("trigger_count", 0) + 1
-                        merged = True
-                        logger.debug(f"情境 '{text}' 合并到特定 '{s['content']}'")
-                        break
+            if specific_matchers is None:
+                specific_matchers = self._build_matchers(
+                    self.specific.get(session_id, [])
+                )
+            for s, matcher in specific_matchers:
+                matcher.set_seq1(text)
+                if matcher.ratio() > threshold:
+                    s["trigger_count"] = s.get("trigger_count", 0) + 1
+                    self._mark_dirty("specific", session_id)
+                    merged = True
+                    logger.debug(f"情境 '{text}' 合并到特定 '{s['content']}'")
+                    break
 
             if not merged:
                 remaining.append(item)
 
+        # 没有任何条目被合并时保持原样，避免每次维护都重写所有会话的分片
+        if len(remaining) == len(self.contextual[session_id]):
+            return
+
         self.contextual[session_id] = remaining
         self._refresh_buffer_markers(session_id)
-        self._dirty_contextual = True
-        asyncio.create_task(self._schedule_save())
+        self._mark_dirty("contextual", session_id)
+
+    @staticmethod
+    def _build_matchers(
+        traits: list[dict[str, Any]],
+    ) -> list[tuple[dict[str, Any], difflib.SequenceMatcher]]:
+        """
+        为每条候选表征构建以其 content 为 b 序列的 SequenceMatcher。
+        b 序列的字符索引只在这里计算一次；比对时 set_seq1 换入新文本即可，
+        结果与 SequenceMatcher(None, text, content).ratio() 完全一致。
+        """
+        return [
+            (trait, difflib.SequenceMatcher(None, "", trait["content"]))
+            for trait in traits
+        ]
 
     async def save_contextual(self):
-        async with self.lock:
-            try:
-                with open(self.contextual_file, "w", encoding="utf-8") as f:
-                    json.dump(self.contextual, f, ensure_ascii=False, indent=4)
-                self._dirty_contextual = False
-            except OSError as e:
-                logger.error(f"保存情境表征文件失败: {e}")
+        await self._save_layer("contextual", "情境表征")
 
     # ==================== 特定表征 ====================
 
     def load_specific(self):
-        if os.path.exists(self.specific_file):
-            try:
-                with open(self.specific_file, encoding="utf-8") as f:
-                    self.specific = json.load(f)
-            except (OSError, json.JSONDecodeError) as e:
-                logger.error(f"加载特定表征文件失败: {e}")
-                self.specific = {}
-        else:
-            self.specific = {}
+        self.specific = self._load_layer("specific", "特定表征")
 
     def get_specific_for_session(self, session_id: str) -> list[dict[str, Any]]:
         return self.specific.get(session_id, [])
 
-    def add_or_update_specific(
-        self, session_id: str, content: str, trigger_regex: str
+    def add_or_update_specific_bulk(
+        self, session_id: str, items: list[tuple[str, str]]
     ):
-        try:
-            re.compile(trigger_regex)
-        except re.error as e:
-            logger.error(
-                f"特定表征 '{content}' 的正则表达式无效: {trigger_regex}, 错误: {e}"
-            )
-            return
+        """批量新增或累加特定表征，所有条目共用一个时间戳并只调度一次保存。"""
+        current_time = time.monotonic()
+        traits = self.specific.setdefault(session_id, [])
+        index = self._get_specific_index(session_id, traits)
 
-        current_time = asyncio.get_running_loop().time()
-        if session_id not in self.specific:
-            self.specific[session_id] = []
+        changed = False
+        for content, trigger_regex in items:
+            try:
+                re.compile(trigger_regex)
+            except re.error as e:
+                logger.error(
+                    f"特定表征 '{content}' 的正则表达式无效: {trigger_regex}, 错误: {e}"
+                )
+                continue
 
-        for trait in self.specific[session_id]:
-            if trait["content"] == content:
+            trait = index.get(content)
+            if trait is not None:
                 trait["trigger_count"] = trait.get("trigger_count", 0) + 1
                 trait["last_seen"] = current_time
-                self._dirty_specific = True
-                asyncio.create_task(self._schedule_save())
-                return
-
-        self.specific[session_id].append({
-            "content": content,
-            "trigger_regex": trigger_regex,
-            "trigger_count": 1,
-            "first_seen": current_time,
-            "last_seen": current_time,
-        })
-        self._dirty_specific = True
-        asyncio.create_task(self._schedule_save())
+            else:
+                trait = {
+                    "content": content,
+                    "trigger_regex": trigger_regex,
+                    "trigger_count": 1,
+                    "first_seen": current_time,
+                    "last_seen": current_time,
+                }
+                traits.append(trait)
+                index[content] = trait
+            changed = True
+
+        if changed:
+            self._mark_dirty("specific", session_id)
+            self._schedule_save()
+
+    def _get_specific_index(
+        self, session_id: str, traits: list[dict[str, Any]]
+    ) -> dict[str, dict[str, Any]]:
+        """
+        按 content 索引特定表征，使查重为 O(1)。
+        列表被整体替换（容量淘汰、清空风格）后对象身份改变，索引随之重建。
+        """
+        cached = self._specific_index.get(session_id)
+        if cached is None or cached[0] is not traits:
+            index = {}
+            for trait in traits:
+                index.setdefault(trait["content"], trait)
+            cached = (traits, index)
+            self._specific_index[session_id] = cached
+        return cached[1]
 
     def remove_lowest_specific(self, session_id: str, count: int):
         if session_id not in self.specific or count <= 0:
             return
-        traits = sorted(
-            self.specific[session_id], key=lambda t: t.get("trigger_count", 0)
+        traits = self.specific[session_id]
+        # 只需选出 count 个最低者：堆选择 O(n log k)，且保留其余条目的原有顺序
+        dropped = set(
+            heapq.nsmallest(
+                count,
+                range(len(traits)),
+                key=lambda i: traits[i].get("trigger_count", 0),
+            )
         )
-        self.specific[session_id] = traits[count:]
-        self._dirty_specific = True
-        asyncio.create_task(self._schedule_save())
+        self.specific[session_id] = [
+            t for i, t in enumerate(traits) if i not in dropped
+        ]
+        self._mark_dirty("specific", session_id)
+        self._schedule_save()
 
     def check_specific_capacity(self, session_id: str):
         max_specific = self.config.get("max_specific_per_session", 200)
@@ -320,82 +429,308 @@ class DataManager:
             self.remove_lowest_specific(session_id, excess)
 
     async def save_specific(self):
-        async with self.lock:
-            try:
-                with open(self.specific_file, "w", encoding="utf-8") as f:
-                    json.dump(self.specific, f, ensure_ascii=False, indent=4)
-                self._dirty_specific = False
-            except OSError as e:
-                logger.error(f"保存特定表征文件失败: {e}")
+        await self._save_layer("specific", "特定表征")
+
+    def has_styles_for_session(self, session_id: str) -> bool:
+        """会话在任意一层中是否已有表征，只做三次字典查找。"""
+        return any(getattr(self, layer).get(session_id) for layer in LAYERS)
+
+    def clear_session_styles(self, session_id: str):
+        """清空会话的三层表征，并调度一次防抖保存。"""
+        cleared = False
+        for layer in LAYERS:
+            data = getattr(self, layer)
+            if session_id in data:
+                data[session_id] = []
+                self._mark_dirty(layer, session_id)
+                cleared = True
+        if cleared:
+            self._schedule_save()
 
     # ==================== 公共保存逻辑 ====================
 
-    async def _schedule_save(self):
-        if self._save_timer is not None:
-            self._save_timer.cancel()
-        self._save_timer = asyncio.create_task(self._delayed_save())
+    def _mark_dirty(self, layer: str, session_id: str):
+        self._dirty_sessions[layer].add(session_id)
+        self.styles_version[session_id] = self.styles_version.get(session_id, 0) + 1
+
+    def _shard_path(self, layer: str, session_id: str) -> str:
+        # 会话 ID 形如 "platform:GroupMessage:123"，转义后才能安全用作文件名
+        filename = quote(session_id, safe="") + ".json"
+        return os.path.join(self.layer_dirs[layer], filename)
+
+    def _load_layer(self, layer: str, label: str) -> dict[str, list[dict[str, Any]]]:
+        legacy_file = os.path.join(self.data_dir, f"{layer}.json")
+        if os.path.exists(legacy_file):
+            self._migrate_legacy_layer(layer, label, legacy_file)
+
+        data = {}
+        layer_dir = self.layer_dirs[layer]
+        for name in os.listdir(layer_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(layer_dir, name), "rb") as f:
+                    data[unquote(name[: -len(".json")])] = _loads(f.read())
+            except (OSError, json.JSONDecodeError) as e:
+                logger.error(f"加载{label}分片 {name} 失败: {e}")
+        return data
+
+    def _migrate_legacy_layer(self, layer: str, label: str, legacy_file: str):
+        """将旧版单文件拆分为按会话的分片，并把旧文件重命名为 .bak。"""
+        try:
+            with open(legacy_file, "rb") as f:
+                data = _loads(f.read())
+            for session_id, traits in data.items():
+                self._atomic_write(
+                    self._shard_path(layer, session_id), _dumps(traits)
+                )
+            os.replace(legacy_file, legacy_file + ".bak")
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"迁移旧版{label}文件失败: {e}")
+            return
+        logger.info(f"已将旧版{label}文件拆分为按会话存储，原文件重命名为 .bak")
+
+    async def _save_layer(self, layer: str, label: str):
+        dirty = self._dirty_sessions[layer]
+        if not dirty:
+            return
+        self._dirty_sessions[layer] = set()
+        data = getattr(self, layer)
+        payloads = [
+            (session_id, _dumps(data.get(session_id, [])))
+            for session_id in dirty
+        ]
+        async with self.lock:
+            for i, (session_id, payload) in enumerate(payloads):
+                try:
+                    await self._run_io(
+                        self._atomic_write,
+                        self._shard_path(layer, session_id),
+                        payload,
+                    )
+                except OSError as e:
+                    self._dirty_sessions[layer].add(session_id)
+                    logger.error(f"保存{label}分片 {session_id} 失败: {e}")
+                except BaseException:
+                    # 被取消时尚未确认写入的分片重新标脏，留给下一次保存
+                    self._dirty_sessions[layer].update(
+                        sid for sid, _ in payloads[i:]
+                    )
+                    raise
+
+    async def _run_io(self, func: Callable[..., Any], *args: Any):
+        """
+        在单线程执行器中运行文件操作，所有写入按提交顺序依次完成。
+        用 shield 包裹：调用方被取消时操作仍会完整执行，不会被之后提交的写入抢先。
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.shield(loop.run_in_executor(self._io_executor, func, *args))
+
+    @staticmethod
+    def _atomic_write(path: str, payload: bytes):
+        """先写临时文件再原子替换，避免中途崩溃留下半截文件。"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _schedule_save(self):
+        """防抖保存：每次修改只推迟截止时间，整个防抖窗口内复用同一个保存任务。"""
+        self._save_deadline = time.monotonic() + self._save_delay
+        if self._save_timer is None:
+            self._save_timer = asyncio.create_task(self._delayed_save())
 
     async def _delayed_save(self):
-        await asyncio.sleep(self._save_delay)
-        if self._dirty_universal:
-            await self.save_universal()
-        if self._dirty_contextual:
-            await self.save_contextual()
-        if self._dirty_specific:
-            await self.save_specific()
+        while (remaining := self._save_deadline - time.monotonic()) > 0:
+            await asyncio.sleep(remaining)
+        # 先释放任务槽位，保存期间发生的修改会调度新的保存任务
+        self._save_timer = None
+        await self.save_universal()
+        await self.save_contextual()
+        await self.save_specific()
         if self._dirty_chat_history:
             await self.save_chat_history()
-        self._save_timer = None
 
     async def force_save(self):
         if self._save_timer is not None:
             self._save_timer.cancel()
             self._save_timer = None
-        if self._dirty_universal:
-            await self.save_universal()
-        if self._dirty_contextual:
-            await self.save_contextual()
-        if self._dirty_specific:
-            await self.save_specific()
+        await self.save_universal()
+        await self.save_contextual()
+        await self.save_specific()
         if self._dirty_chat_history:
             await self.save_chat_history()
+        await self.flush_history()
+
+    async def close(self):
+        """将聊天记录日志刷到磁盘并关闭文件句柄，插件卸载时在 force_save 之后调用。"""
+        async with self.lock:
+            if self._history_log.closed:
+                return
+            try:
+                await self._run_io(self._close_history_log)
+            except OSError as e:
+                logger.error(f"同步聊天记录日志失败: {e}")
+            self._io_executor.shutdown(wait=False)
+
+    def _close_history_log(self):
+        try:
+            self._history_log.flush()
+            os.fsync(self._history_log.fileno())
+        finally:
+            self._history_log.close()
 
     # ==================== 聊天记录 ====================
 
     def load_chat_history(self):
         if os.path.exists(self.chat_history_file):
             try:
-                with open(self.chat_history_file, encoding="utf-8") as f:
-                    self.chat_history = json.load(f)
+                with open(self.chat_history_file, "rb") as f:
+                    self.chat_history = {
+                        session_id: self._new_history(map(_intern_sender, messages))
+                        for session_id, messages in _loads(f.read()).items()
+                    }
             except (OSError, json.JSONDecodeError) as e:
                 logger.error(f"加载聊天记录文件失败: {e}")
                 self.chat_history = {}
         else:
             self.chat_history = {}
+        self._rendered_history = {
+            session_id: self._new_history(map(_render_message, messages))
+            for session_id, messages in self.chat_history.items()
+        }
+        self._replay_history_log()
+
+    def _new_history(self, items: Iterable[Any] = ()) -> deque:
+        """每个会话只保留最近 max_history_per_session 条，超出部分自动淘汰。"""
+        maxlen = self.config.get("max_history_per_session", 500)
+        return deque(items, maxlen=maxlen)
+
+    def _replay_history_log(self):
+        """将快照之后追加的日志回放到内存中的聊天记录。"""
+        if not os.path.exists(self.chat_history_log_file):
+            return
+        try:
+            with open(self.chat_history_log_file, "rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        message = _loads(line)
+                    except json.JSONDecodeError:
+                        # 进程异常退出时最后一行可能不完整
+                        logger.warning("跳过聊天记录日志中损坏的一行")
+                        continue
+                    # 每行解析出的会话 ID 都是新字符串，驻留后字典查找可走身份比较的快路径
+                    session_id = sys.intern(message.pop("sid"))
+                    self._append_history(session_id, message)
+                    self._dirty_chat_history = True
+        except OSError as e:
+            logger.error(f"回放聊天记录日志失败: {e}")
 
     async def save_chat_history(self):
+        """写入聊天记录快照，并截断已被快照覆盖的追加日志。"""
         async with self.lock:
+            # deque 交给编码器就地序列化，无需先为每个会话复制一份 list
+            payload = _dumps(self.chat_history, default=list)
+            # 待写入日志的消息已包含在快照中，丢弃它们以免回放时重复
+            self._pending_history = []
+            self._dirty_chat_history = False
             try:
-                with open(self.chat_history_file, "w", encoding="utf-8") as f:
-                    json.dump(self.chat_history, f, ensure_ascii=False, indent=4)
-                self._dirty_chat_history = False
+                await self._run_io(self._write_history_snapshot, payload)
             except OSError as e:
+                self._dirty_chat_history = True
                 logger.error(f"保存聊天记录文件失败: {e}")
+            except BaseException:
+                # 被取消时无法确认快照是否已写入，保持脏标记以便下次重写
+                self._dirty_chat_history = True
+                raise
+
+    def _write_history_snapshot(self, payload: bytes):
+        """
+        写入快照后清空日志。两步在同一次线程调用中完成：
+        锁保证日志中的记录都已包含在快照里，因此可以直接截断。
+        """
+        self._atomic_write(self.chat_history_file, payload)
+        self._history_log.truncate(0)
 
-    async def add_message_to_history(self, session_id: str, message: dict[str, Any]):
-        if session_id not in self.chat_history:
-            self.chat_history[session_id] = []
-        self.chat_history[session_id].append(message)
+    def add_message_to_history(
+        self, session_id: str, sender: str, content: str, timestamp: float
+    ):
+        """同步追加一条消息：只操作内存，日志由 flush_history 批量写入，调用方无需 await。"""
+        message = {
+            "sender": _to_valid_utf8(sender),
+            "content": _to_valid_utf8(content),
+            "timestamp": timestamp,
+        }
+        self._append_history(session_id, message)
+        self._pending_history.append((session_id, message))
         self._dirty_chat_history = True
-        await self._schedule_save()
 
-    def get_chat_history(
-        self, session_id: str, limit: int = 50
-    ) -> list[dict[str, Any]]:
-        return self.chat_history.get(session_id, [])[-limit:]
+    async def flush_history(self):
+        """
+        将积累的新消息一次性追加到日志并 fsync，文件操作放到线程中执行。
+        在锁内取出待写消息，保证不会与快照截断交错导致日志出现重复记录。
+        """
+        async with self.lock:
+            if not self._pending_history:
+                return
+            payload = b"".join(
+                _dumps_line({"sid": session_id, **message})
+                for session_id, message in self._pending_history
+            )
+            self._pending_history = []
+            try:
+                await self._run_io(self._write_history_log, payload)
+            except OSError as e:
+                # 消息仍在内存中，标脏后下一次快照会把它们一并保存
+                self._dirty_chat_history = True
+                logger.error(f"写入聊天记录日志失败: {e}")
+
+    def _write_history_log(self, payload: bytes):
+        self._history_log.write(payload)
+        self._history_log.flush()
+        os.fsync(self._history_log.fileno())
+
+    def _append_history(self, session_id: str, message: dict[str, Any]):
+        history = self.chat_history.get(session_id)
+        if history is None:
+            history = self.chat_history[session_id] = self._new_history()
+            self._rendered_history[session_id] = self._new_history()
+        history.append(_intern_sender(message))
+        self._rendered_history[session_id].append(_render_message(message))
+
+    def get_recent_history_lines(
+        self, session_id: str, max_chars: int, limit: int = 100
+    ) -> list[str]:
+        """
+        从最新消息往前取预先渲染好的 "发送者: 内容" 文本行，
+        直到条数达到 limit 或累计字符数超出 max_chars，按时间顺序返回。
+        最新一条本身就超出预算时，只保留它末尾的 max_chars 个字符。
+        """
+        rendered = self._rendered_history.get(session_id)
+        if not rendered or max_chars <= 0:
+            return []
+        lines = []
+        used = 0
+        for line in islice(reversed(rendered), limit):
+            used += len(line) + 1
+            if used > max_chars:
+                if not lines:
+                    lines.append(line[len(line) - max_chars:])
+                break
+            lines.append(line)
+        lines.reverse()
+        return lines
+
+    def get_chat_history_count(self, session_id: str) -> int:
+        return len(self.chat_history.get(session_id, ()))
 
     async def clear_chat_history(self, session_id: str):
         if session_id in self.chat_history:
-            self.chat_history[session_id] = []
+            self.chat_history[session_id].clear()
+            self._rendered_history[session_id].clear()
             self._dirty_chat_history = True
-            await self._schedule_save()
+            self._schedule_save()
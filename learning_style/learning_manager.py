@@ -1,12 +1,15 @@
 import json
 import re
-from typing import Any
+from collections.abc import Iterable
 
 from astrbot.api import logger
 from astrbot.api.star import Star
 
 from .data_manager import DataManager
 
+# 匹配 LLM 输出中 ```json ... ``` 代码块里的 JSON 对象
+_JSON_BLOCK_RE = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL)
+
 
 class LearningManager:
     """
@@ -23,11 +26,14 @@ class LearningManager:
 
     async def analyze_and_learn(self, session_id: str):
         min_history = self.config.get("min_history_for_analysis", 10)
-        chat_history = self.data_manager.get_chat_history(session_id, limit=100)
-        if len(chat_history) < min_history:
+        if self.data_manager.get_chat_history_count(session_id) < min_history:
             return
 
-        prompt = self._build_prompt(session_id, chat_history)
+        history_lines = self.data_manager.get_recent_history_lines(
+            session_id,
+            max_chars=self.config.get("max_prompt_history_chars", 6000),
+        )
+        prompt = self._build_prompt(session_id, history_lines)
 
         try:
             llm_response = await self.context.get_using_provider().text_chat(
@@ -47,27 +53,21 @@ class LearningManager:
         except Exception as e:
             logger.error(f"分析学习过程中发生错误: {e}")
 
-    def _build_prompt(
-        self, session_id: str, chat_history: list[dict[str, Any]]
-    ) -> str:
-        history_str = "\n".join(
-            [f"{msg['sender']}: {msg['content']}" for msg in chat_history]
-        )
+    def _build_prompt(self, session_id: str, history_lines: Iterable[str]) -> str:
+        history_str = "\n".join(history_lines)
 
         universal = self.data_manager.get_universal_for_session(session_id)
-        universal_list = [t["content"] for t in universal] if universal else []
         universal_str = "\n".join(
-            [f"- {c}" for c in universal_list]
-        ) if universal_list else "(无)"
+            f"- {t['content']}" for t in universal
+        ) if universal else "(无)"
 
         # 情境缓冲区提示
         buffer_items = self.data_manager.get_contextual_buffer(session_id)
         contextual_hint = ""
         if buffer_items:
-            lines = [
+            contextual_hint = "\n".join(
                 f"- {t['scene']}→{t['behavior']}" for t in buffer_items
-            ]
-            contextual_hint = "\n".join(lines)
+            )
 
         # 仅非首轮才提供的上下文
         universal_section = ""
@@ -125,8 +125,7 @@ class LearningManager:
 
     async def _parse_and_store_results(self, session_id: str, llm_output: str):
         try:
-            json_pattern = r"```json\s*(\{.*?\})\s*```"
-            match = re.search(json_pattern, llm_output, re.DOTALL)
+            match = _JSON_BLOCK_RE.search(llm_output)
 
             if match:
                 json_str = match.group(1)
@@ -141,33 +140,34 @@ class LearningManager:
                 self.data_manager.replace_universal(session_id, universal)
                 logger.info(f"为会话 {session_id} 更新通用表征: {universal}")
 
-            # 情境表征：逐条添加
-            contextual = results.get("contextual", [])
-            for item in contextual:
+            # 情境表征：整批添加
+            # 取值与过滤在同一次遍历中完成
+            contextual_pairs = []
+            for item in results.get("contextual", []):
                 scene = item.get("scene", "")
                 behavior = item.get("behavior", "")
                 if scene and behavior:
-                    self.data_manager.add_contextual(session_id, scene, behavior)
-
-            if contextual:
+                    contextual_pairs.append((scene, behavior))
+            if contextual_pairs:
+                self.data_manager.add_contextual_bulk(session_id, contextual_pairs)
                 logger.info(
                     f"为会话 {session_id} 添加情境表征: "
-                    f"{[f'{c['scene']}→{c['behavior']}' for c in contextual]}"
+                    f"{[f'{s}→{b}' for s, b in contextual_pairs]}"
                 )
 
-            # 特定表征：逐条添加
-            specific = results.get("specific", [])
-            for item in specific:
+            # 特定表征：整批添加
+            specific_items = []
+            for item in results.get("specific", []):
                 content = item.get("content", "")
                 trigger_regex = item.get("trigger_regex", "")
                 if content and trigger_regex:
-                    self.data_manager.add_or_update_specific(
-                        session_id, content, trigger_regex
-                    )
-
-            if specific:
+                    specific_items.append((content, trigger_regex))
+            if specific_items:
+                self.data_manager.add_or_update_specific_bulk(
+                    session_id, specific_items
+                )
                 logger.info(
-                    f"为会话 {session_id} 添加特定表征: {[s['content'] for s in specific]}"
+                    f"为会话 {session_id} 添加特定表征: {[c for c, _ in specific_items]}"
                 )
 
             self.data_manager.check_specific_capacity(session_id)
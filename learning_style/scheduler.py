@@ -5,12 +5,16 @@ from astrbot.api import logger
 from .data_manager import DataManager
 from .learning_manager import LearningManager
 
+# 新消息写入聊天记录日志的周期（秒），进程崩溃时最多丢失这么长时间内的消息
+HISTORY_FLUSH_INTERVAL = 1.0
+
 
 class Scheduler:
     """
     定时任务调度：
     - analysis_task: 定期分析聊天记录（默认 1h）
     - maintenance_task: 合并情境缓冲区到通用/特定（默认 24h）
+    - flush_task: 批量写入新消息到聊天记录日志（1s）
     """
 
     def __init__(
@@ -24,6 +28,7 @@ class Scheduler:
         self.config = config
         self.analysis_task: asyncio.Task | None = None
         self.maintenance_task: asyncio.Task | None = None
+        self.flush_task: asyncio.Task | None = None
         self.is_running = False
 
     def start(self):
@@ -31,6 +36,7 @@ class Scheduler:
             self.is_running = True
             self.analysis_task = asyncio.create_task(self._run_analysis())
             self.maintenance_task = asyncio.create_task(self._run_maintenance())
+            self.flush_task = asyncio.create_task(self._run_history_flush())
             logger.info("定时任务已启动。")
 
     async def stop(self):
@@ -43,6 +49,9 @@ class Scheduler:
             if self.maintenance_task:
                 self.maintenance_task.cancel()
                 tasks.append(self.maintenance_task)
+            if self.flush_task:
+                self.flush_task.cancel()
+                tasks.append(self.flush_task)
 
             if tasks:
                 try:
@@ -58,12 +67,18 @@ class Scheduler:
             await asyncio.sleep(analysis_interval)
             logger.info("开始执行周期性聊天记录分析...")
             all_sessions = list(self.data_manager.chat_history.keys())
-            for session_id in all_sessions:
-                try:
-                    await self.learning_manager.analyze_and_learn(session_id)
-                    await asyncio.sleep(0)
-                except Exception as e:
-                    logger.error(f"分析会话 {session_id} 时出错: {e}")
+            # 各会话的 LLM 调用互不依赖，限制并发数后同时发起
+            concurrency = max(1, int(self.config.get("analysis_concurrency", 4)))
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def analyze(session_id: str):
+                async with semaphore:
+                    try:
+                        await self.learning_manager.analyze_and_learn(session_id)
+                    except Exception as e:
+                        logger.error(f"分析会话 {session_id} 时出错: {e}")
+
+            await asyncio.gather(*(analyze(session_id) for session_id in all_sessions))
             await self.data_manager.force_save()
 
     async def _run_maintenance(self):
@@ -74,14 +89,15 @@ class Scheduler:
             await self._perform_maintenance()
             await asyncio.sleep(0)
 
-    async def _perform_maintenance(self):
-        """合并情境缓冲区到通用/特定，不处理已确认的情境。"""
-        all_sessions = list(self.data_manager.contextual.keys())
-        for session_id in all_sessions:
+    async def _run_history_flush(self):
+        while self.is_running:
+            await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
             try:
-                self.data_manager.merge_contextual_buffer(session_id)
+                await self.data_manager.flush_history()
             except Exception as e:
-                logger.error(f"维护会话 {session_id} 时出错: {e}")
+                logger.error(f"写入聊天记录日志时出错: {e}")
 
-        await self.data_manager.force_save()
+    async def _perform_maintenance(self):
+        """合并情境缓冲区到通用/特定，不处理已确认的情境。"""
+        await self.data_manager.perform_maintenance()
         logger.info("风格维护完成（情境缓冲合并）。")
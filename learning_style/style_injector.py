@@ -1,9 +1,14 @@
+import heapq
+from collections import OrderedDict
 from typing import Any
 
 from astrbot.api import logger
 
 from .style_selector import StyleSelector
 
+# 风格摘要/提示文本缓存最多保留的会话数
+STYLE_CACHE_SIZE = 256
+
 
 class StyleInjector:
     """
@@ -17,53 +22,27 @@ class StyleInjector:
         self.data_manager = data_manager
         self.config = config
         self.style_selector = StyleSelector()
+        # session_id -> (构建时的表征版本号, 风格摘要, 风格提示文本)，按 LRU 保留最近的会话
+        self._view_cache: OrderedDict[str, tuple[int, dict[str, Any], str]] = (
+            OrderedDict()
+        )
 
     def should_inject_style(self, session_id: str) -> bool:
         if not self.config.get("enable_style_injection", True):
             return False
-
-        universal = self.data_manager.get_universal_for_session(session_id)
-        contextual = self.data_manager.get_contextual_for_session(session_id)
-        specific = self.data_manager.get_specific_for_session(session_id)
-        return bool(universal) or bool(contextual) or bool(specific)
+        # 直接查询数据层：尚未学到风格的会话无需构建摘要，也不会挤占视图缓存
+        return self.data_manager.has_styles_for_session(session_id)
 
     def inject_style_to_prompt(
         self, session_id: str, original_system_prompt: str
     ) -> str:
-        if not self.should_inject_style(session_id):
-            return original_system_prompt
-
         try:
-            style_parts = []
-
-            # 1. 通用表征：全部注入
-            universal = self.data_manager.get_universal_for_session(session_id)
-            if universal:
-                contents = [t["content"] for t in universal]
-                style_parts.append(
-                    self.style_selector.build_style_text("通用风格", contents)
-                )
-
-            # 2. 情境表征：全部注入
-            contextual = self.data_manager.get_contextual_for_session(session_id)
-            if contextual:
-                style_parts.append(
-                    self.style_selector.build_contextual_text(contextual)
-                )
-
-            # 3. 特定表征：全部注入，LLM 自行判断使用时机
-            specific = self.data_manager.get_specific_for_session(session_id)
-            if specific:
-                contents = [t["content"] for t in specific]
-                style_parts.append(
-                    self.style_selector.build_style_text("群内流行说法", contents)
-                )
-
-            if not style_parts:
+            if not self.should_inject_style(session_id):
                 return original_system_prompt
 
-            style_text = "；".join(style_parts)
-            full_style_text = f"在回复时，请尽量采用以下风格特点：{style_text}"
+            _, full_style_text = self._get_session_view(session_id)
+            if not full_style_text:
+                return original_system_prompt
 
             if not original_system_prompt.strip():
                 return full_style_text
@@ -77,10 +56,76 @@ class StyleInjector:
             return original_system_prompt
 
     def get_style_summary(self, session_id: str) -> dict[str, Any]:
+        summary, _ = self._get_session_view(session_id)
+        return summary
+
+    def _get_session_view(self, session_id: str) -> tuple[dict[str, Any], str]:
+        """
+        返回会话的 (风格摘要, 风格提示文本)。
+        两者取自同一份表征快照并一起缓存，表征版本号未变时直接复用。
+        """
+        version = self.data_manager.styles_version.get(session_id, 0)
+        cached = self._view_cache.get(session_id)
+        if cached is not None and cached[0] == version:
+            self._view_cache.move_to_end(session_id)
+            return cached[1], cached[2]
+
         universal = self.data_manager.get_universal_for_session(session_id)
         contextual = self.data_manager.get_contextual_for_session(session_id)
         specific = self.data_manager.get_specific_for_session(session_id)
-
+        summary = self._build_style_summary(universal, contextual, specific)
+        style_text = self._build_style_text(universal, contextual, specific)
+
+        self._view_cache[session_id] = (version, summary, style_text)
+        self._view_cache.move_to_end(session_id)
+        if len(self._view_cache) > STYLE_CACHE_SIZE:
+            self._view_cache.popitem(last=False)
+        return summary, style_text
+
+    def _build_style_text(
+        self,
+        universal: list[dict[str, Any]],
+        contextual: list[dict[str, Any]],
+        specific: list[dict[str, Any]],
+    ) -> str:
+        # 前缀、各段与分隔符放进同一个列表，最后只 join 一次
+        segments = ["在回复时，请尽量采用以下风格特点："]
+
+        # 1. 通用表征：全部注入
+        if universal:
+            contents = [t["content"] for t in universal]
+            segments += (
+                self.style_selector.build_style_text("通用风格", contents),
+                "；",
+            )
+
+        # 2. 情境表征：全部注入
+        if contextual:
+            segments += (
+                self.style_selector.build_contextual_text(contextual),
+                "；",
+            )
+
+        # 3. 特定表征：全部注入，LLM 自行判断使用时机
+        if specific:
+            contents = [t["content"] for t in specific]
+            segments += (
+                self.style_selector.build_style_text("群内流行说法", contents),
+                "；",
+            )
+
+        if len(segments) == 1:
+            return ""
+
+        segments.pop()  # 去掉末尾多余的分隔符
+        return "".join(segments)
+
+    @staticmethod
+    def _build_style_summary(
+        universal: list[dict[str, Any]],
+        contextual: list[dict[str, Any]],
+        specific: list[dict[str, Any]],
+    ) -> dict[str, Any]:
         total = len(universal) + len(contextual) + len(specific)
 
         if total == 0:
@@ -99,10 +144,11 @@ class StyleInjector:
         contextual_preview = [
             f"{t['scene']}→{t['behavior']}" for t in contextual[:3]
         ]
-        specific_sorted = sorted(
-            specific, key=lambda t: t.get("trigger_count", 0), reverse=True
+        # 只需前三名：nlargest 与 sorted(..., reverse=True)[:3] 结果相同，但无需整体排序
+        specific_top = heapq.nlargest(
+            3, specific, key=lambda t: t.get("trigger_count", 0)
         )
-        specific_preview = [t["content"] for t in specific_sorted[:3]]
+        specific_preview = [t["content"] for t in specific_top]
 
         return {
             "has_styles": True,
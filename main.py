@@ -1,4 +1,4 @@
-import asyncio
+import time
 
 from astrbot.api import logger
 from astrbot.api.event import AstrMessageEvent, filter
@@ -45,13 +45,9 @@ class IearningStylePlugin(Star):
         if not message_content:
             return
 
-        message = {
-            "sender": event.get_sender_name(),
-            "content": message_content,
-            "timestamp": asyncio.get_running_loop().time(),
-        }
-
-        await self.data_manager.add_message_to_history(session_id, message)
+        self.data_manager.add_message_to_history(
+            session_id, event.get_sender_name(), message_content, time.monotonic()
+        )
 
     @filter.on_llm_request()
     async def on_llm_request(self, event: AstrMessageEvent, req):
@@ -72,43 +68,15 @@ class IearningStylePlugin(Star):
             yield event.plain_result("当前会话还没有学习到任何风格特点。")
             return
 
-        response = "当前会话风格状态：\n"
-        response += f"通用表征：{summary['universal_count']} 条\n"
-        response += f"情境表征：{summary['contextual_count']} 条\n"
-        response += f"特定表征：{summary['specific_count']} 条\n"
-
-        if summary["universal_preview"]:
-            response += (
-                f"通用 Top-3：{', '.join(summary['universal_preview'])}\n"
-            )
-
-        if summary["contextual_preview"]:
-            response += (
-                f"情境 Top-3：{', '.join(summary['contextual_preview'])}\n"
-            )
-
-        if summary["specific_preview"]:
-            response += (
-                f"特定 Top-3：{', '.join(summary['specific_preview'])}\n"
-            )
-
-        yield event.plain_result(response.strip())
+        yield event.plain_result(
+            self._format_style_summary("当前会话风格状态：", summary)
+        )
 
     @filter.command("清空风格")
     async def clear_styles(self, event: AstrMessageEvent):
         session_id = event.unified_msg_origin
 
-        if session_id in self.data_manager.universal:
-            self.data_manager.universal[session_id] = []
-            self.data_manager._dirty_universal = True
-        if session_id in self.data_manager.contextual:
-            self.data_manager.contextual[session_id] = []
-            self.data_manager._dirty_contextual = True
-        if session_id in self.data_manager.specific:
-            self.data_manager.specific[session_id] = []
-            self.data_manager._dirty_specific = True
-
-        asyncio.create_task(self.data_manager._schedule_save())
+        self.data_manager.clear_session_styles(session_id)
         yield event.plain_result("已清空当前会话的所有学习风格。")
 
     @filter.command("学习总结")
@@ -116,9 +84,8 @@ class IearningStylePlugin(Star):
         """手动触发当前会话的学习分析"""
         session_id = event.unified_msg_origin
 
-        chat_history = self.data_manager.get_chat_history(session_id, limit=100)
         min_history = self.config.get("min_history_for_analysis", 10)
-        if len(chat_history) < min_history:
+        if self.data_manager.get_chat_history_count(session_id) < min_history:
             yield event.plain_result(
                 f"当前会话聊天记录不足 {min_history} 条，无法进行分析。"
             )
@@ -130,25 +97,35 @@ class IearningStylePlugin(Star):
             await self.learning_manager.analyze_and_learn(session_id)
 
             summary = self.style_injector.get_style_summary(session_id)
-            response = "学习分析完成！\n"
-            response += f"通用表征：{summary['universal_count']} 条\n"
-            response += f"情境表征：{summary['contextual_count']} 条\n"
-            response += f"特定表征：{summary['specific_count']} 条"
-
-            if summary["universal_preview"]:
-                response += f"\n通用 Top-3：{', '.join(summary['universal_preview'])}"
-            if summary["contextual_preview"]:
-                response += f"\n情境 Top-3：{', '.join(summary['contextual_preview'])}"
-            if summary["specific_preview"]:
-                response += f"\n特定 Top-3：{', '.join(summary['specific_preview'])}"
-
-            yield event.plain_result(response)
+            yield event.plain_result(
+                self._format_style_summary("学习分析完成！", summary)
+            )
 
         except Exception as e:
             logger.error(f"手动触发学习分析失败: {e}")
             yield event.plain_result(f"学习分析失败：{e}")
 
+    @staticmethod
+    def _format_style_summary(header: str, summary: dict) -> str:
+        """将风格摘要格式化为回复文本：每个字段只读取一次，逐行收集后一次拼接。"""
+        lines = [
+            header,
+            f"通用表征：{summary['universal_count']} 条",
+            f"情境表征：{summary['contextual_count']} 条",
+            f"特定表征：{summary['specific_count']} 条",
+        ]
+        for label, key in (
+            ("通用", "universal_preview"),
+            ("情境", "contextual_preview"),
+            ("特定", "specific_preview"),
+        ):
+            preview = summary[key]
+            if preview:
+                lines.append(f"{label} Top-3：{', '.join(preview)}")
+        return "\n".join(lines)
+
     async def terminate(self):
         await self.scheduler.stop()
         await self.data_manager.force_save()
+        await self.data_manager.close()
         logger.info("学习风格插件已卸载并停止定时任务。")